@@ -1,12 +1,18 @@
+import asyncio
+import hashlib
 from typing import Union
 
+import aiohttp
+
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters import AdminFilter
 
 from aiogram import types
 from aiogram.dispatcher.filters.state import StatesGroup, State
+from aiogram.utils.exceptions import FileIsTooBig, TelegramAPIError
 
 from bot import bot
+from response_templates import compile_template, TemplateSyntaxError
 
 import logging
 
@@ -18,6 +24,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Commands with their own handlers (see handlers.py) that only send a text response
+MEDIA_UNSUPPORTED_COMMANDS = ("help", "remind", "joke")
+
 
 class MyAdminFilter(AdminFilter):
     def __init__(self, db):
@@ -48,6 +57,7 @@ class Form(StatesGroup):
     edit_panel = State()
     edit_command_name = State()
     edit_command_response = State()
+    edit_command_media = State()
     edit_panel_name = State()
     edit_panel_response = State()
     edit_panel_subcommand = State()
@@ -56,6 +66,15 @@ class Form(StatesGroup):
 
 
 def setup_admin_handlers(dp, db):
+    async def check_response_template(msg: types.Message, response: str):
+        # Responses are compiled here so that a broken template never reaches the database
+        try:
+            compile_template(response)
+        except TemplateSyntaxError as e:
+            await msg.reply(f"Incorrect response template: {e}. Please enter it again.")
+            return False
+        return True
+
     @dp.message_handler(commands=['is_admin'])
     async def handle_is_admin_command(msg: types.Message):
         logger.info(f"Received a /is_admin command from admin {msg.from_user.id} | {msg.from_user.username}")
@@ -125,11 +144,13 @@ def setup_admin_handlers(dp, db):
             types.InlineKeyboardButton("Edit command name", callback_data="admin_edit_command_name"))
         keyboard.add(
             types.InlineKeyboardButton("Edit command response", callback_data="admin_edit_command_response"))
+        keyboard.add(
+            types.InlineKeyboardButton("Edit command media", callback_data="admin_edit_command_media"))
         await msg.reply("Choose what you want to edit exactly:", reply_markup=keyboard)
         await state.update_data(command=command)
 
     @dp.callback_query_handler(MyAdminFilter(db),
-                               lambda query: query.data in ["admin_edit_command_name", "admin_edit_command_response"], state=Form.edit_command)
+                               lambda query: query.data in ["admin_edit_command_name", "admin_edit_command_response", "admin_edit_command_media"], state=Form.edit_command)
     async def handle_edit_command_name_response_callback(query: types.CallbackQuery, state: FSMContext):
         state_data = await state.get_data()
         old_command = state_data['command']
@@ -143,6 +164,14 @@ def setup_admin_handlers(dp, db):
             await bot.send_message(query.from_user.id,
                                    "Please enter the new response for the command.")
             await Form.edit_command_response.set()
+        elif query.data == "admin_edit_command_media":
+            if old_command in MEDIA_UNSUPPORTED_COMMANDS:
+                await bot.send_message(query.from_user.id, f"Command /{old_command} can't have media.")
+                await state.finish()
+                return
+            await bot.send_message(query.from_user.id,
+                                   "Please send the photo, document or sticker for the command, or /remove to remove the current media.")
+            await Form.edit_command_media.set()
 
     @dp.message_handler(state=Form.edit_command_name)
     async def edit_command_name_step(msg: types.Message, state: FSMContext):
@@ -162,6 +191,8 @@ def setup_admin_handlers(dp, db):
     @dp.message_handler(state=Form.edit_command_response)
     async def edit_command_response_step(msg: types.Message, state: FSMContext):
         new_response = msg.text
+        if not await check_response_template(msg, new_response):
+            return
         await state.update_data(response=new_response)
         state_data = await state.get_data()
         command = state_data['command']
@@ -171,6 +202,57 @@ def setup_admin_handlers(dp, db):
         await msg.reply(f"Response for command /{command} was successfully updated to '{new_response}'.")
         await state.finish()
 
+    @dp.message_handler(state=Form.edit_command_media,
+                        content_types=[types.ContentType.PHOTO, types.ContentType.DOCUMENT, types.ContentType.STICKER])
+    async def edit_command_media_step(msg: types.Message, state: FSMContext):
+        if msg.photo:
+            media_type, file_id = "photo", msg.photo[-1].file_id
+        elif msg.document:
+            media_type, file_id = "document", msg.document.file_id
+        else:
+            media_type, file_id = "sticker", msg.sticker.file_id
+
+        # The file is downloaded only once to hash it, every later send reuses its file_id
+        try:
+            content = await bot.download_file_by_id(file_id)
+        except FileIsTooBig:
+            await msg.reply("This file is too big (Telegram bots can't download files over 20 MB). Please send another one.")
+            return
+        except TelegramAPIError as e:
+            logger.warning(f"Couldn't download media file {file_id}: {e}")
+            await msg.reply(f"Telegram refused to give this file ({e}). Please send another one.")
+            return
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Couldn't download media file {file_id}: {e}")
+            await msg.reply("Couldn't reach Telegram to download this file. Please try sending it again.")
+            return
+        file_hash = hashlib.sha256(content.getvalue()).hexdigest()
+
+        state_data = await state.get_data()
+        command = state_data['command']
+        if not await db.set_command_media(command, media_type, file_id, file_hash):
+            await msg.reply(f"There is no /{command} command.")
+            await state.finish()
+            return
+        logger.info(f"Media for command /{command} was updated by admin {msg.from_user.id} | {msg.from_user.username}")
+        await msg.reply(f"Media for command /{command} was successfully updated.")
+        await state.finish()
+
+    @dp.message_handler(state=Form.edit_command_media, content_types=types.ContentType.ANY)
+    async def edit_command_media_text_step(msg: types.Message, state: FSMContext):
+        if not msg.text or msg.text.strip() != '/remove':
+            await msg.reply("Incorrect format. Please send a photo, document or sticker, or /remove to remove the current media.")
+            return
+        state_data = await state.get_data()
+        command = state_data['command']
+        if not await db.remove_command_media(command):
+            await msg.reply(f"There is no /{command} command.")
+            await state.finish()
+            return
+        logger.info(f"Media for command /{command} was removed by admin {msg.from_user.id} | {msg.from_user.username}")
+        await msg.reply(f"Media for command /{command} was successfully removed.")
+        await state.finish()
+
     @dp.message_handler(state=Form.edit_panel)
     async def edit_panel_step(msg: types.Message, state: FSMContext):
         data = msg.text.split(maxsplit=1)
@@ -184,13 +266,15 @@ def setup_admin_handlers(dp, db):
             types.InlineKeyboardButton("Edit panel-command name", callback_data="admin_edit_panel_name"))
         keyboard.add(
             types.InlineKeyboardButton("Edit panel-command response", callback_data="admin_edit_panel_response"))
+        keyboard.add(
+            types.InlineKeyboardButton("Edit panel-command media", callback_data="admin_edit_panel_media"))
         keyboard.add(
             types.InlineKeyboardButton("Edit panel-subcommand (name or response)", callback_data="admin_edit_panel_subcommand"))
         await msg.reply("Choose what you want to edit:", reply_markup=keyboard)
         await state.update_data(command=command)
 
     @dp.callback_query_handler(MyAdminFilter(db),
-                               lambda query: query.data in ["admin_edit_panel_name", "admin_edit_panel_response", "admin_edit_panel_subcommand"], state=Form.edit_panel)
+                               lambda query: query.data in ["admin_edit_panel_name", "admin_edit_panel_response", "admin_edit_panel_media", "admin_edit_panel_subcommand"], state=Form.edit_panel)
     async def handle_edit_choice_callback(query: types.CallbackQuery, state: FSMContext):
         logger.info(f"Received a /{query.data} command from user {query.from_user.id} | {query.from_user.username}")
         state_data = await state.get_data()
@@ -205,6 +289,14 @@ def setup_admin_handlers(dp, db):
             await bot.send_message(query.from_user.id,
                                    "Please enter the new response text.")
             await Form.edit_panel_response.set()
+        elif query.data == "admin_edit_panel_media":
+            if old_command in MEDIA_UNSUPPORTED_COMMANDS:
+                await bot.send_message(query.from_user.id, f"Command /{old_command} can't have media.")
+                await state.finish()
+                return
+            await bot.send_message(query.from_user.id,
+                                   "Please send the photo, document or sticker for the panel command, or /remove to remove the current media.")
+            await Form.edit_command_media.set()
         elif query.data == "admin_edit_panel_subcommand":
             await state.update_data(old_command=old_command)
             await bot.send_message(query.from_user.id,
@@ -229,6 +321,8 @@ def setup_admin_handlers(dp, db):
     @dp.message_handler(state=Form.edit_panel_response)
     async def edit_panel_response_step(msg: types.Message, state: FSMContext):
         new_response = msg.text
+        if not await check_response_template(msg, new_response):
+            return
         await state.update_data(response=new_response)
         state_data = await state.get_data()
         command = state_data['command']
@@ -289,6 +383,8 @@ def setup_admin_handlers(dp, db):
     @dp.message_handler(state=Form.edit_subcommand_response)
     async def edit_subcommand_response_step(msg: types.Message, state: FSMContext):
         new_response = msg.text
+        if not await check_response_template(msg, new_response):
+            return
         await state.update_data(response=new_response)
         state_data = await state.get_data()
         command = state_data['subcommand']
@@ -348,6 +444,8 @@ def setup_admin_handlers(dp, db):
             return
         command = data[0][1:]
         response = data[1]
+        if not await check_response_template(msg, response):
+            return
         await db.add_command(command, response)
         logger.info(f"New command /{command} was added by admin {msg.from_user.id} | {msg.from_user.username}")
         await msg.reply(f"Command /{command} with response '{response}' was successfully added.")
@@ -362,6 +460,8 @@ def setup_admin_handlers(dp, db):
             return
         command = data[0][1:]
         response = data[1] if len(data) > 1 else None
+        if response and not await check_response_template(msg, response):
+            return
         panel_id = await db.add_panel(command, response)
         logger.info(f"New panel /{command} was added by admin {msg.from_user.id} | {msg.from_user.username}")
         await msg.reply(
@@ -382,6 +482,8 @@ def setup_admin_handlers(dp, db):
             return
         subcommand = data[0][1:]
         response = data[1]
+        if not await check_response_template(msg, response):
+            return
         await db.add_command(subcommand, response)
         state_data = await state.get_data()
         panel_id = state_data['panel_id']
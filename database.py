@@ -1,12 +1,45 @@
+import asyncio
 import datetime
+import logging
+import time
 
 import asyncpg
 from config import DB_HOST, DB_NAME, DB_USER, DB_PASS
 
+try:
+    # Optional read replica, see README
+    from config import DB_REPLICA_HOST
+except ImportError:
+    DB_REPLICA_HOST = None
+
+try:
+    from config import DB_REPLICA_PORT
+except ImportError:
+    DB_REPLICA_PORT = 5432
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait for the replica before falling back to the primary
+REPLICA_TIMEOUT = 3
+# Seconds during which reads skip the replica after it has failed
+REPLICA_COOLDOWN = 30
+
+# Errors after which a read is retried on the primary
+REPLICA_UNAVAILABLE_ERRORS = (
+    OSError,
+    asyncio.TimeoutError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError,
+    asyncpg.exceptions.InterfaceError,
+)
+
 
 class Database:
     def __init__(self):
         self.pool = None
+        self.replica_pool = None
+        self.replica_down_until = 0.0
+        self.replica_lock = asyncio.Lock()
 
     async def connect_to_db(self):
         self.pool = await asyncpg.create_pool(
@@ -15,17 +48,78 @@ class Database:
             user=DB_USER,
             password=DB_PASS
         )
+        # If the replica is down now, it is retried after the cooldown
+        await self._get_replica_pool()
+
+    def _mark_replica_down(self, error: Exception):
+        self.replica_down_until = time.monotonic() + REPLICA_COOLDOWN
+        logger.warning(f"Read replica {DB_REPLICA_HOST}:{DB_REPLICA_PORT} is unavailable, "
+                       f"using the primary for the next {REPLICA_COOLDOWN} s: {error}")
+
+    async def _get_replica_pool(self):
+        if not DB_REPLICA_HOST or time.monotonic() < self.replica_down_until:
+            return None
+        if self.replica_pool is None:
+            # The pool is created lazily so that a replica that was down at startup is picked up later
+            async with self.replica_lock:
+                # Reads that waited on the lock give up if the attempt before them failed
+                if time.monotonic() < self.replica_down_until:
+                    return None
+                if self.replica_pool is None:
+                    try:
+                        self.replica_pool = await asyncpg.create_pool(
+                            host=DB_REPLICA_HOST,
+                            port=DB_REPLICA_PORT,
+                            database=DB_NAME,
+                            user=DB_USER,
+                            password=DB_PASS,
+                            timeout=REPLICA_TIMEOUT
+                        )
+                    except REPLICA_UNAVAILABLE_ERRORS as e:
+                        self._mark_replica_down(e)
+                        return None
+        return self.replica_pool
+
+    async def _read(self, method: str, query: str, *args):
+        # Read-only queries go to the replica if it is available, falling back to the primary
+        replica_pool = await self._get_replica_pool()
+        if replica_pool is not None:
+            try:
+                conn = await replica_pool.acquire(timeout=REPLICA_TIMEOUT)
+            except asyncio.TimeoutError:
+                # All replica connections are busy, so only this read goes to the primary
+                conn = None
+            except REPLICA_UNAVAILABLE_ERRORS as e:
+                self._mark_replica_down(e)
+                conn = None
+            if conn is not None:
+                try:
+                    return await getattr(conn, method)(query, *args, timeout=REPLICA_TIMEOUT)
+                except REPLICA_UNAVAILABLE_ERRORS as e:
+                    self._mark_replica_down(e)
+                finally:
+                    await replica_pool.release(conn)
+        async with self.pool.acquire() as conn:
+            return await getattr(conn, method)(query, *args)
 
     async def select_all_from_table(self, table_name: str):
-        async with self.pool.acquire() as conn:
-            rows = await conn.fetch(f'SELECT * FROM {table_name}')
+        rows = await self._read("fetch", f'SELECT * FROM {table_name}')
         return rows
 
     async def get_command_response(self, command: str):
-        async with self.pool.acquire() as conn:
-            response = await conn.fetchval("SELECT response FROM commands WHERE command = $1", command)
+        response = await self._read("fetchval", "SELECT response FROM commands WHERE command = $1", command)
         return response
 
+    async def get_command(self, command: str):
+        # Response together with the attached media (if any) in one query
+        row = await self._read(
+            "fetchrow",
+            "SELECT c.response, m.media_type, m.file_id FROM commands c "
+            "LEFT JOIN media m ON m.id = c.media_id WHERE c.command = $1",
+            command
+        )
+        return row
+
     async def update_command_name(self, old_command: str, new_command: str):
         async with self.pool.acquire() as conn:
             await conn.execute(
@@ -43,9 +137,29 @@ class Database:
             new_response, command
         )
 
-    async def get_panel_commands(self, parent_command: str):
+    async def set_command_media(self, command: str, media_type: str, file_id: str, file_hash: str):
+        # One transaction, so a missing command doesn't leave an orphaned media row behind
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                command_id = await conn.fetchval("SELECT id FROM commands WHERE command = $1 FOR UPDATE", command)
+                if command_id is None:
+                    return False
+                # Identical uploads are deduplicated by content hash and keep their first file_id
+                media_id = await conn.fetchval(
+                    "INSERT INTO media (media_type, file_id, file_hash) VALUES ($1, $2, $3) "
+                    "ON CONFLICT (media_type, file_hash) DO UPDATE SET file_hash = EXCLUDED.file_hash RETURNING id",
+                    media_type, file_id, file_hash
+                )
+                await conn.execute("UPDATE commands SET media_id = $1 WHERE id = $2", media_id, command_id)
+        return True
+
+    async def remove_command_media(self, command: str):
         async with self.pool.acquire() as conn:
-            rows = await conn.fetch("SELECT command FROM panel_commands WHERE panel_id = (SELECT id FROM commands WHERE command = $1)", parent_command)
+            result = await conn.execute("UPDATE commands SET media_id = NULL WHERE command = $1", command)
+        return result != "UPDATE 0"
+
+    async def get_panel_commands(self, parent_command: str):
+        rows = await self._read("fetch", "SELECT command FROM panel_commands WHERE panel_id = (SELECT id FROM commands WHERE command = $1)", parent_command)
         return rows
 
     async def delete_from_table(self, id: int, table_name: str):
@@ -89,8 +203,7 @@ class Database:
         return row
 
     async def get_panel_id(self, command: str):
-        async with self.pool.acquire() as conn:
-            panel_id = await conn.fetchval("SELECT id FROM commands WHERE command = $1", command)
+        panel_id = await self._read("fetchval", "SELECT id FROM commands WHERE command = $1", command)
         return panel_id
 
     async def add_admin(self, telegram_id):
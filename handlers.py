@@ -5,6 +5,7 @@ import aiohttp
 from aiogram import types
 
 from bot import bot
+from response_templates import render_response, uses_placeholders
 
 import logging
 
@@ -16,19 +17,53 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+MAX_CAPTION_LENGTH = 1024
+
 
 def setup_handlers(dp, db):
+    async def send_command_response(chat_id: int, response: str, row, reply_markup=None, reply_to_message_id=None):
+        # Media is always sent by its stored Telegram file_id, so the bytes are never re-uploaded
+        media_type, file_id = row['media_type'], row['file_id']
+        if media_type not in ("photo", "document", "sticker"):
+            await bot.send_message(chat_id, response, reply_markup=reply_markup,
+                                   reply_to_message_id=reply_to_message_id)
+            return
+
+        # Stickers can't have a caption and captions are limited to 1024 characters,
+        # so in these cases the response goes as a separate message after the media
+        if media_type != "sticker" and response and len(response) <= MAX_CAPTION_LENGTH:
+            caption, text = response, None
+        else:
+            caption, text = None, response
+        media_reply_markup = None if text else reply_markup
+        if media_type == "photo":
+            await bot.send_photo(chat_id, file_id, caption=caption, reply_markup=media_reply_markup,
+                                 reply_to_message_id=reply_to_message_id)
+        elif media_type == "document":
+            await bot.send_document(chat_id, file_id, caption=caption, reply_markup=media_reply_markup,
+                                    reply_to_message_id=reply_to_message_id)
+        else:
+            await bot.send_sticker(chat_id, file_id, reply_markup=media_reply_markup,
+                                   reply_to_message_id=reply_to_message_id)
+        if text:
+            await bot.send_message(chat_id, text, reply_markup=reply_markup)
+
     @dp.message_handler(commands=["start", "help"])
     async def handle_basic_commands(msg: types.Message):
         if msg.is_command():
             command = msg.get_command()[1:]
             logger.info(f"Received /{command} command from user: {msg.from_user.id} | {msg.from_user.username}")
-            response = await db.get_command_response(command)
-            if response:
+            row = await db.get_command(command)
+            response = row['response'] if row else None
+            if response or (row and row['file_id']):
                 # ----------------- START COMMAND ---------------------------------------------
                 if command == "start":
-                    # An extraction of the RESPONSE message from the database
-                    await bot.send_message(msg.from_user.id, f"{response}, {msg.from_user.first_name}")
+                    # An extraction of the RESPONSE message (and media) from the database
+                    text = render_response(response, msg.from_user)
+                    if text and not uses_placeholders(response):
+                        # A plain greeting without placeholders still gets the user's name appended
+                        text = f"{text}, {msg.from_user.first_name}"
+                    await send_command_response(msg.from_user.id, text, row)
 
                     # An extraction of the AVAILABLE TELEGRAM-KEYBOARD ELEMENTS from the database
                     commands = await db.get_panel_commands("start")
@@ -37,11 +72,11 @@ def setup_handlers(dp, db):
                         keyboard.add(types.InlineKeyboardButton(command['command'], callback_data=command['command']))
                     await msg.reply("Here is the list of commands that I can do:", reply_markup=keyboard)
                 # ----------------- HELP COMMAND ---------------------------------------------
-                elif command == "help":
+                elif command == "help" and response:
                     commands = await db.select_all_from_table("commands")
                     commands_text = "\n".join([f"/{command['command']}" for command in commands if
                                                command['command'] != "help" and command['command'] != "start"])
-                    response = f"{response}\n{commands_text}"
+                    response = f"{render_response(response, msg.from_user)}\n{commands_text}"
                     await bot.send_message(msg.from_user.id, response)
                 # ----------------------------------------------------------------------------
 
@@ -50,7 +85,7 @@ def setup_handlers(dp, db):
         args = msg.get_args().split(maxsplit=2)
         if len(args) != 3:
             response = await db.get_command_response("remind")
-            await msg.reply(response)
+            await msg.reply(render_response(response, msg.from_user))
             return
 
         try:
@@ -88,7 +123,7 @@ def setup_handlers(dp, db):
         logger.info(f"Received /joke command from user: {msg.from_user.id} | {msg.from_user.username}")
         command = msg.get_command()
         command = command[1:]
-        response = await db.get_command_response(command)
+        response = render_response(await db.get_command_response(command), msg.from_user)
         async with aiohttp.ClientSession() as session:
             async with session.get("https://v2.jokeapi.dev/joke/Any") as joke_response:
                 data = await joke_response.json()
@@ -105,8 +140,8 @@ def setup_handlers(dp, db):
         if msg.is_command():
             command = msg.get_command()[1:]
             logger.info(f"Received /{command} command from user: {msg.from_user.id} | {msg.from_user.username}")
-            response = await db.get_command_response(command)
-            if response:
+            row = await db.get_command(command)
+            if row and (row['response'] or row['file_id']):
                 panel_id = await db.get_panel_id(command)
                 if panel_id is not None:
                     # The command is a panel
@@ -114,10 +149,12 @@ def setup_handlers(dp, db):
                     keyboard = types.InlineKeyboardMarkup()
                     for command in commands:
                         keyboard.add(types.InlineKeyboardButton(command['command'], callback_data=command['command']))
-                    await msg.reply(response, reply_markup=keyboard)
+                    await send_command_response(msg.chat.id, render_response(row['response'], msg.from_user), row,
+                                                reply_markup=keyboard,
+                                                reply_to_message_id=msg.message_id)
                 else:
                     # The command is not a panel
-                    await bot.send_message(msg.from_user.id, response)
+                    await send_command_response(msg.from_user.id, render_response(row['response'], msg.from_user), row)
             else:
                 await msg.reply(f"Sorry, I don't have a response for the /{command} command.")
         else:
@@ -133,14 +170,14 @@ def setup_handlers(dp, db):
         commands = await db.select_all_from_table("commands")
         commands_text = "\n".join([f"/{command['command']}" for command in commands if
                                    command['command'] != "help" and command['command'] != "start"])
-        response = f"{response}\n{commands_text}"
+        response = f"{render_response(response, query.from_user)}\n{commands_text}"
         await bot.send_message(query.from_user.id, response)
 
     @dp.callback_query_handler(text="joke")
     async def handle_joke_command_callback(query: types.CallbackQuery):
         command = query.data
         logger.info(f"Received /joke command from user: {query.from_user.id} | {query.from_user.username}")
-        response = await db.get_command_response(command)
+        response = render_response(await db.get_command_response(command), query.from_user)
         async with aiohttp.ClientSession() as session:
             async with session.get("https://v2.jokeapi.dev/joke/Any") as joke_response:
                 data = await joke_response.json()
@@ -156,8 +193,8 @@ def setup_handlers(dp, db):
     async def handle_callback_query(query: types.CallbackQuery):
         command = query.data
         logger.info(f"Received /{command} command from user: {query.from_user.id} | {query.from_user.username}")
-        response = await db.get_command_response(command)
-        if response:
+        row = await db.get_command(command)
+        if row and (row['response'] or row['file_id']):
             panel_id = await db.get_panel_id(command)
             if panel_id is not None:
                 # The command is a panel
@@ -165,10 +202,11 @@ def setup_handlers(dp, db):
                 keyboard = types.InlineKeyboardMarkup()
                 for command in commands:
                     keyboard.add(types.InlineKeyboardButton(command['command'], callback_data=command['command']))
-                await bot.send_message(query.from_user.id, response, reply_markup=keyboard)
+                await send_command_response(query.from_user.id, render_response(row['response'], query.from_user), row,
+                                            reply_markup=keyboard)
             else:
                 # The command is not a panel
-                await bot.send_message(query.from_user.id, response)
+                await send_command_response(query.from_user.id, render_response(row['response'], query.from_user), row)
         else:
             await bot.send_message(query.from_user.id, f"Sorry, I don't have a response for the /{command} command.")
 
@@ -0,0 +1,120 @@
+import functools
+import re
+from datetime import datetime
+
+from aiogram import types
+
+# Placeholders that can be used in command responses, e.g. "Hello, {first_name}!"
+PLACEHOLDERS = ("first_name", "last_name", "username", "user_id", "date")
+
+# "{{" and "}}" are literal braces, "{...}" is a tag, everything else is plain text
+TOKEN_RE = re.compile(r"\{\{|\}\}|\{[^{}]*\}|[^{}]+|[{}]")
+
+
+class TemplateSyntaxError(ValueError):
+    pass
+
+
+class Template:
+    def __init__(self, parts, placeholders):
+        self.parts = parts
+        self.placeholders = placeholders
+
+    def render(self, context: dict):
+        return _render(self.parts, context)
+
+
+def _render(parts, context):
+    return "".join(part(context) for part in parts)
+
+
+def _text(value):
+    return lambda context: value
+
+
+def _placeholder(name):
+    return lambda context: str(context.get(name) or "")
+
+
+def _conditional(name, then_parts, else_parts):
+    return lambda context: _render(then_parts if context.get(name) else else_parts, context)
+
+
+def _check_name(name, tag):
+    if name not in PLACEHOLDERS:
+        raise TemplateSyntaxError(f"unknown placeholder in {tag}, available ones: "
+                                  + ", ".join(f"{{{p}}}" for p in PLACEHOLDERS))
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_template(text: str):
+    # Cached by the response text itself, so an edited response is compiled again on its first use
+    placeholders = set()
+    # Stack of (parts, name of the open conditional, then-parts if inside {else})
+    stack = [([], None, None)]
+    for token in TOKEN_RE.findall(text):
+        parts = stack[-1][0]
+        if token == "{{":
+            parts.append(_text("{"))
+        elif token == "}}":
+            parts.append(_text("}"))
+        elif token in ("{", "}"):
+            raise TemplateSyntaxError(f"unmatched '{token}', use '{token * 2}' for a literal brace")
+        elif token.startswith("{"):
+            tag = token[1:-1].strip()
+            if tag.startswith("if "):
+                name = tag[3:].strip()
+                _check_name(name, token)
+                placeholders.add(name)
+                stack.append(([], name, None))
+            elif tag == "else":
+                if stack[-1][1] is None:
+                    raise TemplateSyntaxError("{else} without a matching {if ...}")
+                if stack[-1][2] is not None:
+                    raise TemplateSyntaxError(f"{{if {stack[-1][1]}}} has more than one {{else}}")
+                stack[-1] = ([], stack[-1][1], parts)
+            elif tag == "end":
+                if stack[-1][1] is None:
+                    raise TemplateSyntaxError("{end} without a matching {if ...}")
+                parts, name, then_parts = stack.pop()
+                if then_parts is None:
+                    then_parts, parts = parts, []
+                stack[-1][0].append(_conditional(name, then_parts, parts))
+            else:
+                _check_name(tag, token)
+                placeholders.add(tag)
+                parts.append(_placeholder(tag))
+        else:
+            parts.append(_text(token))
+    if len(stack) > 1:
+        raise TemplateSyntaxError(f"{{if {stack[-1][1]}}} is not closed with {{end}}")
+    return Template(stack[0][0], frozenset(placeholders))
+
+
+def template_context(user: types.User):
+    return {
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "username": user.username,
+        "user_id": user.id,
+        "date": datetime.now().strftime('%d.%m.%y'),
+    }
+
+
+def render_response(response: str, user: types.User):
+    if not response:
+        return response
+    try:
+        template = compile_template(response)
+    except TemplateSyntaxError:
+        # Responses saved before templates were validated are sent verbatim
+        return response
+    return template.render(template_context(user))
+
+
+def uses_placeholders(response: str):
+    try:
+        return bool(compile_template(response).placeholders)
+    except TemplateSyntaxError:
+        # Sent verbatim by render_response, so nothing gets filled in
+        return False